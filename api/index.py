@@ -1,13 +1,19 @@
+import copy
+import functools
 import icalendar
 import logging
 import json
+import re
 import typing
 import urllib3
 
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from dateutil import rrule
 from http.server import BaseHTTPRequestHandler
 from os import path
-from thefuzz import fuzz
+from rapidfuzz import fuzz, process
 from time import perf_counter
 from urllib.parse import parse_qs
 
@@ -16,10 +22,54 @@ CONFIG_FILE = path.join("config", "config.json")
 FUZZY_MATCH_THRESHOLD = 90
 DEBUG_EVENT_COUNT = 10
 
+# Calendars parsed by previous requests, keyed by URL, along with the validators (ETag and/or
+# Last-Modified) the server sent with them. The function instance sticks around between requests
+# while it's warm, so this lets us skip downloading and parsing calendars which haven't changed.
+calendar_cache : typing.Dict[str, typing.Tuple[typing.Dict[str, str], icalendar.Calendar]] = {}
+
 def get_config() -> typing.Dict:
     with open(CONFIG_FILE, "r") as f:
         return json.load(f)
 
+def configure_logging(config : typing.Dict) -> None:
+    """
+    Sets up logging the first time a request comes in. The function instance handles many requests
+    while it's warm, and once the root logger has a handler there's nothing left to do.
+    """
+
+    if not logging.getLogger().handlers:
+        logging.basicConfig(level = logging.DEBUG if config["debug"] == "true" else logging.INFO)
+
+def summary_text(event : icalendar.Event) -> typing.Optional[str]:
+    """
+    Returns the event's SUMMARY (title) as a plain string, or None if it doesn't have one.
+    """
+
+    summary = event.get('SUMMARY')
+    return None if summary is None else str(summary)
+
+def summaries_match(summary1 : typing.Optional[str], summary2 : typing.Optional[str]) -> bool:
+    """
+    Determines if two event titles are similar enough to be considered the same event. Passing the
+    threshold as the score cutoff lets RapidFuzz bail out early on titles that can't match.
+    """
+
+    return fuzz.partial_ratio(summary1, summary2, score_cutoff = FUZZY_MATCH_THRESHOLD) > 0
+
+def matching_summaries(summary : typing.Optional[str], choices : typing.List[typing.Optional[str]]) -> typing.List[int]:
+    """
+    Returns the indices of the titles in choices which match the given title according to
+    summaries_match. All of the comparisons are done in a single call into RapidFuzz, rather than
+    one call per pair.
+    """
+
+    if summary is None:
+        return []
+
+    matches = process.extract(summary, choices, scorer = fuzz.partial_ratio, processor = None,
+                              score_cutoff = FUZZY_MATCH_THRESHOLD, limit = None)
+    return [idx for _, _, idx in matches]
+
 def events_overlap(event1 : icalendar.Event, event2 : icalendar.Event, time_only : bool = False) -> bool:
     """
     Determines if two events overlap in time. If time_only is True, only the time of day is considered;
@@ -50,7 +100,8 @@ def events_overlap(event1 : icalendar.Event, event2 : icalendar.Event, time_only
         return False
 
     # Check for type mismatch, i.e. if one event has a datetime but the other only has a date
-    if type(start1) != type(start2) or type(end1) != type(end2):
+    if isinstance(start1, datetime) != isinstance(start2, datetime) or \
+        isinstance(end1, datetime) != isinstance(end2, datetime):
         return False
 
     if time_only:
@@ -61,30 +112,139 @@ def events_overlap(event1 : icalendar.Event, event2 : icalendar.Event, time_only
 
     return start1 <= end2 and end1 >= start2
 
-def recurring_events_are_equal(event1 : icalendar.Event, event2 : icalendar.Event) -> bool:
+def rrule_key(event : icalendar.Event) -> typing.Tuple:
+    """
+    Returns a cheap key for a recurring event's RRULE which must be equal for two recurrences to be
+    equal according to recurrences_are_equal, so that most non-matching pairs can be ruled out
+    without parsing either rule.
+
+    Only FREQ and INTERVAL are included. recurrences_are_equal deliberately ignores COUNT, UNTIL
+    and WKST, and the BY* parts can be implied by DTSTART (e.g. a weekly rule without BYDAY recurs
+    on the start date's weekday), so two rules with different BY* parts may still be equal.
+    """
+
+    recur = event.get('RRULE')
+
+    # Parsed rules hold a list of values for each part, but rules built in code may not
+    def first(value):
+        return value[0] if isinstance(value, list) else value
+
+    return first(recur.get('FREQ')), first(recur.get('INTERVAL', 1))
+
+# Frequencies whose occurrences are evenly spaced when the rule has no BY* parts
+SIMPLE_RRULE_STEPS = {
+    rrule.DAILY: timedelta(days = 1),
+    rrule.WEEKLY: timedelta(weeks = 1),
+}
+
+def last_occurrence(rule : rrule.rrule) -> typing.Any:
     """
-    Compares two recurring events to see if they're equal. Only works for recurring events.
-    Equality is determined by comparing the SUMMARY (title) and RRULE properties of the event.
+    Returns the last occurrence of a rule with a COUNT or UNTIL. Getting this from the rule with
+    rule[-1] expands every single occurrence, so for daily and weekly rules with no BY* parts, where
+    the occurrences are evenly spaced, we work it out directly instead.
+    """
+
+    step = SIMPLE_RRULE_STEPS.get(rule._freq)
+    if step is None or any(rule._original_rule.values()) or \
+        (rule._count is None) == (rule._until is None):
+        return rule[-1]
+
+    step *= rule._interval
+    start = rule._dtstart
+
+    if rule._count is not None:
+        if rule._count < 1:
+            return rule[-1]
+        return start + step * (rule._count - 1)
+
+    if rule._until < start:
+        return rule[-1]
+
+    # Occurrences keep the same wall clock time, so across a DST change the real time between them
+    # isn't exactly a multiple of step; nudge the estimate onto the last one no later than UNTIL.
+    last = start + step * ((rule._until - start) // step)
+    while last > rule._until:
+        last -= step
+    while last + step <= rule._until:
+        last += step
+
+    return last
+
+@functools.lru_cache(maxsize = 4096)
+def parse_rrule(text : str, dtstart : typing.Any, tzinfo : typing.Any) -> rrule.rrule:
+    """
+    Parses an RRULE, caching the result since the same rules come up again on every request. The
+    rules are never modified after parsing (rrule.replace returns a new rule), so sharing them is
+    safe.
+
+    tzinfo must be dtstart's time zone. It's part of the cache key because datetimes in different
+    time zones compare equal if they're the same instant, but produce different rules.
+    """
+
+    return rrule.rrulestr(text, dtstart = dtstart)
+
+class RecurringEvent:
+    """
+    Wraps a recurring event along with the values recurrences_are_equal needs from it, so that
+    comparing an event against many others only parses its RRULE and expands its last occurrence
+    once. The rule and last occurrence are computed on first use, since most pairs are ruled out by
+    their titles or rrule_key first.
+    """
+
+    __slots__ = ('event', 'summary', 'key', '_rule', '_rule_str', '_last')
+
+    def __init__(self, event : icalendar.Event):
+        assert(event.get('RRULE') is not None)
+
+        self.event = event
+        self.summary = summary_text(event)
+        self.key = rrule_key(event)
+        self._rule = None
+        self._rule_str = None
+        self._last = None
+
+    @property
+    def rule(self) -> rrule.rrule:
+        if self._rule is None:
+            dtstart = self.event.get('DTSTART').dt
+            self._rule = parse_rrule(
+                self.event.get('RRULE').to_ical().decode(icalendar.parser_tools.DEFAULT_ENCODING),
+                dtstart, getattr(dtstart, 'tzinfo', None))
+        return self._rule
+
+    @property
+    def rule_str(self) -> str:
+        if self._rule_str is None:
+            self._rule_str = str(self.rule)
+        return self._rule_str
+
+    @property
+    def bounded(self) -> bool:
+        return self.rule._count is not None or self.rule._until is not None
+
+    @property
+    def last(self) -> typing.Any:
+        """
+        The last occurrence of a bounded rule.
+        """
+
+        if self._last is None:
+            self._last = last_occurrence(self.rule)
+        return self._last
+
+def recurrences_are_equal(event1 : RecurringEvent, event2 : RecurringEvent) -> bool:
+    """
+    Compares the recurrences of two recurring events to see if they're equal. Together with
+    summaries_match on the SUMMARY (title) this determines whether two recurring events are the
+    same; the titles are compared separately so that callers comparing many pairs can rule most of
+    them out cheaply.
     
     IMPORTANT: This almost certainly won't work for recurrences that happen on an hourly,
     minutely, or secondly basis.
     """
 
-    assert(event1.get('RRULE') is not None)
-    assert(event2.get('RRULE') is not None)
-
-    # First ensure that the names of the events are similar enough
-    # TODO: Use ratio instead of partial_ratio. Need download updated ICS for work calendar.
-    if not fuzz.partial_ratio(event1.get('SUMMARY'), event2.get('SUMMARY')) >= FUZZY_MATCH_THRESHOLD:
-        return False
-    
-    rule1 = rrule.rrulestr(
-        event1.get('RRULE').to_ical().decode(icalendar.parser_tools.DEFAULT_ENCODING),
-        dtstart = event1.get('DTSTART').dt)
-    
-    rule2 = rrule.rrulestr(
-        event2.get('RRULE').to_ical().decode(icalendar.parser_tools.DEFAULT_ENCODING),
-        dtstart = event2.get('DTSTART').dt)
+    rule1 = event1.rule
+    rule2 = event2.rule
 
     # It turns out that comparing iCalendar recurrence rules in an intelligent way is quite
     # difficult. The rrule object doesn't even implement __eq__, as two rrules created from the
@@ -101,7 +261,7 @@ def recurring_events_are_equal(event1 : icalendar.Event, event2 : icalendar.Even
     dummy_rule = rule2.replace(dtstart = rule1._dtstart, wkst = rule1._wkst,
                                count = rule1._count, until = rule1._until)
 
-    if not str(rule1) == str(dummy_rule):
+    if not event1.rule_str == str(dummy_rule):
         return False
     
     # From here we can (probably) assume that the events have the same recurrence rules, but because
@@ -110,23 +270,176 @@ def recurring_events_are_equal(event1 : icalendar.Event, event2 : icalendar.Even
     # we can check that the other rule has at least one event between the start and end date of the
     # other.
 
-    if rule1._count is not None or rule1._until is not None:
+    if event1.bounded:
         dtstart = rule1._dtstart
-        dtend = rule1[-1]
+        dtend = event1.last
 
         if len(rule2.between(dtstart, dtend)) == 0:
             return False
     
-    elif rule2._count is not None or rule2._until is not None:
+    elif event2.bounded:
         dtstart = rule2._dtstart
-        dtend = rule2[-1]
+        dtend = event2.last
 
         if len(rule1.between(dtstart, dtend)) == 0:
             return False
         
     # Now, finally, let's check if the event times overlap. We've already validated that the recurrence
     # rules are the same and that they overlap, so we should only have to care about the time of day.
-    return events_overlap(event1, event2, time_only = True)
+    return events_overlap(event1.event, event2.event, time_only = True)
+
+EPOCH = datetime(1970, 1, 1, tzinfo = timezone.utc)
+NAIVE_EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds = 1)
+
+def event_span(event : icalendar.Event) -> typing.Optional[typing.Tuple[str, int, int]]:
+    """
+    Returns (group, start, end) for a single event, where start and end are integers which can be
+    compared against those of any other event in the same group: microseconds since the epoch for
+    datetimes, or day numbers for dates. Comparing integers is much cheaper than comparing
+    datetimes, particularly timezone-aware ones in different time zones.
+
+    Events can only overlap other events in the same group: events_overlap never matches a date
+    against a datetime, and naive datetimes can't be compared against timezone-aware ones.
+
+    Returns None if the event is missing a start or end (see the comment in events_overlap for why
+    this can happen), or if its start and end can't be compared with each other.
+    """
+
+    try:
+        start = event.get('DTSTART').dt
+        end = event.get('DTEND').dt
+    except AttributeError:
+        return None
+
+    if isinstance(start, datetime) != isinstance(end, datetime):
+        return None
+
+    if not isinstance(start, datetime):
+        return "date", start.toordinal(), end.toordinal()
+
+    if (start.tzinfo is None) != (end.tzinfo is None):
+        return None
+
+    if start.tzinfo is None:
+        return "naive", (start - NAIVE_EPOCH) // MICROSECOND, (end - NAIVE_EPOCH) // MICROSECOND
+
+    return "aware", (start - EPOCH) // MICROSECOND, (end - EPOCH) // MICROSECOND
+
+def build_overlap_sweeps(events : typing.Iterable[icalendar.Event]) -> typing.Dict:
+    """
+    Indexes single (non-recurring) events for overlap queries with overlapping_events.
+
+    Events are grouped as described in event_span and each group is sorted by start time. Each group
+    is stored as parallel lists of starts, ends, summaries and events, so that the query loop
+    indexes plain values rather than re-reading properties from the events. Alongside these we keep a running
+    maximum of the end times, which tells us when walking backwards from a given start that no
+    earlier event can reach a given time.
+    """
+
+    groups = {}
+    invalid_times = 0
+
+    for event in events:
+
+        span = event_span(event)
+        if span is None:
+            invalid_times += 1
+            continue
+
+        group, start, end = span
+        groups.setdefault(group, []).append((start, end, summary_text(event), event))
+
+    if invalid_times > 0:
+        logging.warning(f"Ignoring {invalid_times} events which are missing a start or end time, "
+                        "or whose start and end can't be compared")
+
+    sweeps = {}
+    for key, group in groups.items():
+        group.sort(key = lambda entry: entry[0])
+        starts, ends, summaries, grouped_events = (list(column) for column in zip(*group))
+
+        max_ends = []
+        for end in ends:
+            max_ends.append(end if not max_ends or end > max_ends[-1] else max_ends[-1])
+
+        sweeps[key] = (starts, ends, max_ends, summaries, grouped_events)
+
+    return sweeps
+
+def overlapping_events(sweeps : typing.Dict, event : icalendar.Event) -> typing.Iterator[typing.Tuple]:
+    """
+    Yields the (event, summary) of the indexed events which overlap the given event, in the same
+    sense as events_overlap.
+    """
+
+    span = event_span(event)
+    if span is None:
+        return
+
+    group, start, end = span
+    sweep = sweeps.get(group)
+    if sweep is None:
+        return
+
+    starts, ends, max_ends, summaries, events = sweep
+
+    # Everything before idx starts no later than the event ends; walk backwards until no earlier
+    # event can end on or after the event's start.
+    idx = bisect_right(starts, end) - 1
+    while idx >= 0 and max_ends[idx] >= start:
+        if ends[idx] >= start:
+            yield events[idx], summaries[idx]
+        idx -= 1
+
+def overlapping_pairs(primary_events : typing.List[icalendar.Event], target_events : typing.List[icalendar.Event]) -> typing.Iterator[typing.Tuple]:
+    """
+    Yields (primary event, primary summary, target event, target summary) for each pair of single
+    events which overlap. Whichever side is smaller gets indexed with build_overlap_sweeps and the
+    other side is looked up in it, so a handful of events on one side is cheap no matter how many
+    there are on the other. Note that a target event may be yielded more than once.
+    """
+
+    if not primary_events or not target_events:
+        return
+
+    if len(primary_events) <= len(target_events):
+        sweeps = build_overlap_sweeps(primary_events)
+        for event2 in target_events:
+            summary2 = summary_text(event2)
+            for event1, summary1 in overlapping_events(sweeps, event2):
+                yield event1, summary1, event2, summary2
+    else:
+        sweeps = build_overlap_sweeps(target_events)
+        for event1 in primary_events:
+            summary1 = summary_text(event1)
+            for event2, summary2 in overlapping_events(sweeps, event1):
+                yield event1, summary1, event2, summary2
+
+def partition_events(calendar : icalendar.Calendar) -> typing.Tuple[typing.List[icalendar.Event], typing.List[icalendar.Event]]:
+    """
+    Walks the calendar's events once and splits them into (recurring, single) events.
+    """
+
+    recurring = []
+    single = []
+
+    for event in calendar.walk("VEVENT"):
+        if event.get('RRULE') is not None:
+            recurring.append(event)
+        else:
+            single.append(event)
+
+    return recurring, single
+
+def remove_events(calendar : icalendar.Calendar, filtered_ids : typing.Set[int]) -> None:
+    """
+    Removes the events whose id() is in filtered_ids from the calendar in a single pass, rather than
+    calling subcomponents.remove for each one (which scans the whole list every time). The list is
+    updated in place in case anything else holds a reference to it.
+    """
+
+    calendar.subcomponents[:] = [c for c in calendar.subcomponents if id(c) not in filtered_ids]
 
 def filter_duplicates(primary_calendar : icalendar.Calendar, target_calendar : icalendar.Calendar) -> None:
     """
@@ -138,44 +451,55 @@ def filter_duplicates(primary_calendar : icalendar.Calendar, target_calendar : i
 
     logging.debug("Filtering duplicate events")
 
-    filtered = 0
+    filtered_ids = set()
+
+    primary_recurring, primary_single = partition_events(primary_calendar)
+    if not primary_recurring and not primary_single:
+        logging.info("Primary calendar has no events; nothing to filter")
+        return
+
+    target_recurring, target_single = partition_events(target_calendar)
 
     # First filter recurring events. Note: this assumes that duplicate recurring events will be
     # marked as recurring on both calendars; i.e. it doesn't handle the case where one calendar
     # has a recurring event and the other has a single event with the same title.
-    for event1 in primary_calendar.walk("VEVENT"):
-
-        if event1.get('RRULE') is None:
+    #
+    # The primary events are grouped by rrule_key, since only events with the same key can possibly
+    # recur the same way. Within the group we ensure that the names of the events are similar
+    # enough before doing the expensive RRULE comparison.
+    primary_by_key = {}
+    for event1 in map(RecurringEvent, primary_recurring):
+        summaries, events = primary_by_key.setdefault(event1.key, ([], []))
+        summaries.append(event1.summary)
+        events.append(event1)
+
+    for event2 in map(RecurringEvent, target_recurring):
+
+        candidates = primary_by_key.get(event2.key)
+        if candidates is None:
             continue
 
-        for event2 in target_calendar.walk("VEVENT"):
-
-            if event2.get('RRULE') is None:
-                continue
-
-            if recurring_events_are_equal(event1, event2):
-                logging.debug(f"Filtering duplicate recurring event: {event2.get('summary')}")
-                target_calendar.subcomponents.remove(event2)
-                filtered += 1
+        summaries, events = candidates
 
-    # Now we can filter individual duplicate events
-    for event1 in primary_calendar.walk("VEVENT"):
-
-        if event1.get('RRULE') is not None:
-            continue
+        # TODO: Use ratio instead of partial_ratio. Need download updated ICS for work calendar.
+        for idx in matching_summaries(event2.summary, summaries):
+            if recurrences_are_equal(events[idx], event2):
+                logging.debug("Filtering duplicate recurring event: %s", event2.summary)
+                filtered_ids.add(id(event2.event))
+                break
 
-        for event2 in target_calendar.walk("VEVENT"):
+    # Now we can filter individual duplicate events. Rather than comparing every pair of events, we
+    # sort one side by start time so that, for each event on the other side, we can binary search
+    # for the events which start before it ends and only walk back as far as the events which
+    # could still overlap it. Only those candidates are fuzzy matched.
+    for _, summary1, event2, summary2 in overlapping_pairs(primary_single, target_single):
+        if id(event2) not in filtered_ids and summaries_match(summary1, summary2):
+            logging.debug("Filtering duplicate event: %s", summary2)
+            filtered_ids.add(id(event2))
 
-            if event2.get('RRULE') is not None:
-                continue
+    remove_events(target_calendar, filtered_ids)
 
-            if events_overlap(event1, event2) and \
-                fuzz.partial_ratio(event1.get('SUMMARY'), event2.get('SUMMARY')) >= FUZZY_MATCH_THRESHOLD:
-                logging.debug(f"Filtering duplicate event: {event2.get('SUMMARY')}")
-                target_calendar.subcomponents.remove(event2)
-                filtered += 1
-
-    logging.info(f"Filtered {filtered} duplicate events")
+    logging.info(f"Filtered {len(filtered_ids)} duplicate events")
 
 def filter_events_by_keyword(keywords : typing.List[str], calendar : icalendar.Calendar) -> None:
     """
@@ -186,57 +510,135 @@ def filter_events_by_keyword(keywords : typing.List[str], calendar : icalendar.C
 
     logging.debug("Filtering events by keyword")
 
-    filtered = 0
+    if not keywords:
+        return
+
+    # Compile the keywords into a single pattern so each title is scanned once, rather than once
+    # per keyword
+    pattern = re.compile("|".join(re.escape(phrase) for phrase in keywords))
 
-    # Loop through events in the calendar and remove the ones where the title (SUMMARY) contains
-    # any of the FILTER_PHRASES. Note that it's typically not safe to remove items from a list
-    # while iterating over it, but the icalendar.Component.walk is not an iterator per se: it
-    # recursively copies the subcomponents into a list and then returns that list, so we're
-    # not modifying the same list we're iterating over.
+    filtered_ids = set()
+
+    # Loop through events in the calendar and mark the ones where the title (SUMMARY) contains
+    # any of the FILTER_PHRASES, then remove them all at once.
     for event in calendar.walk("VEVENT"):
-        for phrase in keywords:
-            if phrase in event.get('SUMMARY'):
-                logging.debug(f"Filtering event: {event.get('summary')}")
-                calendar.subcomponents.remove(event)
-                filtered += 1
+        summary = summary_text(event)
+        if summary is not None and pattern.search(summary):
+            logging.debug("Filtering event: %s", summary)
+            filtered_ids.add(id(event))
+
+    remove_events(calendar, filtered_ids)
+
+    if filtered_ids:
+        logging.info(f"Filtered {len(filtered_ids)} events by keyword")
+
+def fetch_calendar(http : urllib3.PoolManager, url : str) -> icalendar.Calendar:
+    """
+    Fetches and parses the calendar at the given URL. If we've parsed it before, the request is made
+    conditional on it having changed, and the cached calendar is returned if it hasn't.
+
+    The returned calendar may be shared with later requests, so it must not be modified; use
+    copy_calendar first if it needs to be filtered.
+    """
+
+    headers = {}
+    cached = calendar_cache.get(url)
+    if cached is not None:
+        validators, calendar = cached
+        if "ETag" in validators:
+            headers["If-None-Match"] = validators["ETag"]
+        if "Last-Modified" in validators:
+            headers["If-Modified-Since"] = validators["Last-Modified"]
+
+    response = http.request("GET", url, headers = headers)
+
+    if cached is not None and response.status == 304:
+        logging.debug("Calendar not modified, using cached copy: %s", url)
+        return calendar
 
-    if filtered > 0:
-        logging.info(f"Filtered {filtered} events by keyword")
+    calendar = icalendar.Calendar.from_ical(response.data)
+
+    validators = {name: response.headers[name] for name in ("ETag", "Last-Modified")
+                  if name in response.headers}
+    if validators:
+        calendar_cache[url] = (validators, calendar)
+    else:
+        calendar_cache.pop(url, None)
+
+    return calendar
+
+def copy_calendar(calendar : icalendar.Calendar) -> icalendar.Calendar:
+    """
+    Makes a shallow copy of the calendar with its own list of subcomponents, which is all the
+    filters modify, so events can be filtered out of the copy without affecting the original.
+    """
+
+    result = copy.copy(calendar)
+    result.subcomponents = list(calendar.subcomponents)
+    return result
 
 def get_filtered_calendar(config : typing.Dict) -> icalendar.Calendar:
 
     http = urllib3.PoolManager()
 
-    primary_calendar_content = None
-    target_calendar_content = None
+    # The two calendars are independent, so fetch them at the same time rather than waiting for
+    # one before requesting the other
+    with ThreadPoolExecutor(max_workers = 2) as executor:
+        primary_future = executor.submit(fetch_calendar, http, config["primary_ical"])
+        target_future = executor.submit(fetch_calendar, http, config["target_ical"])
+
+    primary_calendar = None
+    target_calendar = None
     try:
-        primary_calendar_content = http.request("GET", config["primary_ical"]).data
+        primary_calendar = primary_future.result()
     except Exception as e:
         logging.error(f"Error fetching primary calendar: {e}")
         return None
 
     try:
-        target_calendar_content = http.request("GET", config["target_ical"]).data
+        target_calendar = copy_calendar(target_future.result())
     except Exception as e:
         logging.error(f"Error fetching target calendar: {e}")
         return None
 
-    primary_calendar = icalendar.Calendar.from_ical(primary_calendar_content)
-    target_calendar = icalendar.Calendar.from_ical(target_calendar_content)
-
     filter_events_by_keyword(config["filter_keywords"], target_calendar)
     filter_duplicates(primary_calendar, target_calendar)
 
     return target_calendar
 
+def write_calendar(calendar : icalendar.Calendar, out : typing.BinaryIO) -> None:
+    """
+    Writes the calendar to out in the same format as calendar.to_ical(), but one component at a time
+    so that the whole serialized calendar never has to be held in memory at once.
+    """
+
+    # Serialize the calendar without its components to get the BEGIN line and calendar properties,
+    # then write the components between those and the END line
+    shell = copy.copy(calendar)
+    shell.subcomponents = []
+    shell_ical = shell.to_ical()
+
+    footer = f"END:{calendar.name}\r\n".encode(icalendar.parser_tools.DEFAULT_ENCODING)
+    assert(shell_ical.endswith(footer))
+
+    out.write(shell_ical[:-len(footer)])
+    for component in calendar.subcomponents:
+        out.write(component.to_ical())
+    out.write(footer)
+
 class handler(BaseHTTPRequestHandler):
+
+    # Buffer the response rather than making a system call for every write, since the calendar is
+    # written out a component at a time
+    wbufsize = 64 * 1024
+
     def do_GET(self):
 
         t0 = perf_counter()
 
         config = get_config()
     
-        logging.basicConfig(level = logging.DEBUG if config["debug"] == "true" else logging.INFO)
+        configure_logging(config)
         qs = parse_qs(urllib3.util.parse_url(self.path).query)
 
         logging.debug(qs)
@@ -256,9 +658,9 @@ class handler(BaseHTTPRequestHandler):
         self.end_headers()
 
         filtered_calendar = get_filtered_calendar(config)
-        self.wfile.write(filtered_calendar.to_ical())
+        write_calendar(filtered_calendar, self.wfile)
 
-        logging.debug(f"Execution time: {perf_counter() - t0:.3f}s")
+        logging.debug("Execution time: %.3fs", perf_counter() - t0)
 
 # if __name__ == "__main__":
 #     main()
\ No newline at end of file